@@ -19,11 +19,12 @@ load_dotenv()
 
 import logging
 import os
+import subprocess
 import tomllib
 
 import vertexai
 from absl import app, flags
-from software_agent.agent import root_agent
+from software_agent.agent import get_root_agent
 from google.api_core import exceptions as google_exceptions
 from google.cloud import storage
 from vertexai import agent_engines
@@ -125,16 +126,26 @@ def setup_staging_bucket(
     return f"gs://{bucket_name}"
 
 
+def build_wheel() -> None:
+    """
+    Builds the agent wheel from the current checkout, so the deployed package
+    always matches the agent being pickled (including prompt.md, which the
+    uv_build backend packages along with everything else in software_agent/).
+    """
+    logger.info("Building agent wheel: %s", AGENT_WHL_FILE)
+    subprocess.run(["uv", "build", "--wheel", "--out-dir", "."], check=True)
+
+
 def create(env_vars: dict[str, str]) -> None:
     """Creates and deploys the agent."""
     adk_app = AdkApp(
-        agent=root_agent,
+        agent=get_root_agent(),
         enable_tracing=False,
     )
 
+    build_wheel()
     if not os.path.exists(AGENT_WHL_FILE):
         logger.error("Agent wheel file not found at: %s", AGENT_WHL_FILE)
-        # Consider adding instructions here on how to build the wheel file
         raise FileNotFoundError(f"Agent wheel file not found: {AGENT_WHL_FILE}")
 
     logger.info("Using agent wheel file: %s", AGENT_WHL_FILE)
@@ -183,6 +194,10 @@ def main(argv: list[str]) -> None:  # pylint: disable=unused-argument
     # Don't set "GOOGLE_CLOUD_PROJECT" or "GOOGLE_CLOUD_LOCATION"
     # when deploying to Agent Engine. Those are set by the backend.
     env_vars["ROOT_AGENT_MODEL"] = os.getenv("ROOT_AGENT_MODEL")
+    # The agent requires its Cloud Run service URLs at import time.
+    for name in ("VALIDATE_COMPUTER_URL", "DEPLOY_SOFTWARE_URL", "PIPELINE_URL"):
+        if os.getenv(name):
+            env_vars[name] = os.getenv(name)
 
     logger.info("Using PROJECT: %s", project_id)
     logger.info("Using LOCATION: %s", location)
@@ -246,9 +261,9 @@ def main(argv: list[str]) -> None:  # pylint: disable=unused-argument
     except FileNotFoundError as e:
         print(f"\nFile Error: {e}")
         print(
-            "Please ensure the agent wheel file exists in the 'deployment' "
-            "directory and you have run the build script "
-            "(e.g., poetry build --format=wheel --output=deployment')."
+            "The agent wheel is built with uv before deploying. Please ensure "
+            "uv is installed and that 'uv build --wheel --out-dir .' succeeds "
+            "from the repository root."
         )
     except Exception as e:
         print(f"\nAn unexpected error occurred: {e}")
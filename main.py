@@ -1,12 +1,25 @@
 import asyncio
+import logging
+import os
 import uuid
 from dotenv import load_dotenv
+
+# The agent reads its service URLs at import, so load .env first.
+load_dotenv()
+# Unknown LOG_LEVEL values fall back to WARNING rather than failing at startup
+logging.basicConfig(
+    level=logging.getLevelNamesMapping().get(os.getenv("LOG_LEVEL", "WARNING").upper(), logging.WARNING)
+)
+
 from google.adk.runners import Runner
 from google.adk.sessions import InMemorySessionService
-from software_agent.agent import root_agent
-from utils import call_agent_async
+from software_agent.agent import aclose_http_client, get_root_agent, start_keep_warm
+from utils import async_input, call_agent_async
 
-load_dotenv()
+try:
+    import uvloop
+except ImportError:  # uvloop is not available on Windows
+    uvloop = None
 
 # ===== PART 1: Initialize Persistent Session Service =====
 session_service = InMemorySessionService()
@@ -37,27 +50,39 @@ async def main_async():
     # ===== PART 4: Agent Runner Setup =====
     # Create a runner with the memory agent
     runner = Runner(
-        agent=root_agent,
+        agent=get_root_agent(),
         app_name=APP_NAME,
         session_service=session_service,
     )
 
+    # Keep the Cloud Run services warm for the duration of the conversation
+    keep_warm_task = start_keep_warm()
+
     # ===== PART 5: Interactive Conversation Loop =====
     print("\nWelcome to Software Deployment Agent Chat!")    
     print("Type 'exit' or 'quit' to end the conversation.\n")
 
-    while True:
-        # Get user input
-        user_input = input("You: ")
+    try:
+        while True:
+            # Get user input without blocking the loop, so the keep-warm task keeps running while the user is idle
+            user_input = await async_input("You: ")
 
-        # Check if user wants to exit
-        if user_input.lower() in ["exit", "quit"]:
-            print("Ending conversation. Your data has been saved to the database.")
-            break
+            # Check if user wants to exit
+            if user_input.lower() in ["exit", "quit"]:
+                print("Ending conversation. Your data has been saved to the database.")
+                break
 
-        # Process the user query through the agent
-        await call_agent_async(runner, USER_ID, SESSION_ID, user_input)
+            # Process the user query through the agent
+            await call_agent_async(runner, USER_ID, SESSION_ID, user_input)
+    finally:
+        # Stop pinging and release the agent's pooled Cloud Run connections
+        keep_warm_task.cancel()
+        await aclose_http_client()
 
 
 if __name__ == "__main__":
-    asyncio.run(main_async())
\ No newline at end of file
+    # The agent is async-IO bound, so prefer libuv's faster event loop when available
+    if uvloop is not None:
+        uvloop.run(main_async())
+    else:
+        asyncio.run(main_async())
\ No newline at end of file
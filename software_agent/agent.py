@@ -1,147 +1,407 @@
+import asyncio
+import functools
+import hashlib
+import importlib.resources
+import logging
 import os
+import random
+import time
 import httpx
+import orjson
 from google.adk.agents import LlmAgent
 from google.adk.tools.tool_context import ToolContext
+from google.auth import exceptions as google_auth_exceptions
+from google.auth import jwt
 from google.auth.transport import requests as google_requests
 from google.oauth2 import id_token
+from rapidfuzz import fuzz, process, utils
 from .software_list import APPROVED_SOFTWARE_LIST
 
+logger = logging.getLogger(__name__)
+
+def _require_env(name: str) -> str:
+    """Reads a required setting, failing at import rather than mid-conversation."""
+    value = os.getenv(name)
+    if not value:
+        raise RuntimeError(f"{name} environment variable is not set.")
+    return value
+
+# Cloud Run service URLs, read once at import.
+_VALIDATE_URL = _require_env("VALIDATE_COMPUTER_URL")
+_DEPLOY_URL = _require_env("DEPLOY_SOFTWARE_URL")
+# Optional batched validate-and-deploy endpoint used by run_deployment_pipeline.
+_PIPELINE_URL = os.getenv("PIPELINE_URL")
+# Optional health route on the validation service (e.g. "/healthz") for keep-warm pings.
+_KEEP_WARM_PATH = os.getenv("KEEP_WARM_PATH")
+
+# Normalized lookup set and display string, built once instead of per tool call.
+_APPROVED_CF = frozenset(s.casefold() for s in APPROVED_SOFTWARE_LIST)
+_APPROVED_JOINED = ", ".join(APPROVED_SOFTWARE_LIST)
+# rapidfuzz takes its fast path on a tuple of choices.
+_APPROVED_TUPLE = tuple(APPROVED_SOFTWARE_LIST)
+# Number of close matches offered when a requested name isn't approved, and the
+# minimum WRatio score (0-100) for a name to count as close.
+_SUGGESTION_LIMIT = 5
+_SUGGESTION_CUTOFF = 60
+
+# Confirmation messages returned by update_session_state.
+_MSG_COMPUTER = "Computer name '%s' saved."
+_MSG_SOFTWARE = "Software name '%s' saved."
+_MSG_USER = "Username '%s' saved."
+
+# Shared transport for ID token fetches; each Request() wraps its own requests.Session.
+_AUTH_REQ = google_requests.Request()
+
+# Cached ID tokens keyed by audience URL: (token, expiry as a unix timestamp).
+_ID_TOKEN_CACHE: dict[str, tuple[str, float]] = {}
+# Fire-and-forget tasks, referenced here until they finish.
+_BACKGROUND_TASKS: set[asyncio.Task] = set()
+# Refetch a cached token once it is this close to expiring.
+_ID_TOKEN_REFRESH_MARGIN = 60.0
+# Attempts and base backoff delay (seconds) for retryable Cloud Run responses.
+_RETRY_ATTEMPTS = 4
+_RETRY_BASE_DELAY = 0.25
+# Seconds between keep-warm pings, just under Cloud Run's idle scale-down window.
+_KEEP_WARM_INTERVAL = 50.0
+
+class _LoopResources:
+    """
+    The shared HTTP client and ID token locks for one event loop. Pooled
+    connections and asyncio locks are bound to the loop that created them, so
+    each loop that runs the agent gets its own. Connections are only reused
+    within one loop: under one asyncio.run per query, each query starts with a
+    fresh client, which is closed when that loop shuts down.
+    """
+
+    def __init__(self) -> None:
+        # Every tool call reuses pooled keep-alive connections to Cloud Run instead
+        # of paying a fresh TCP + TLS handshake per invocation. HTTP/2 lets
+        # concurrent tool calls multiplex over a single connection.
+        self.http = httpx.AsyncClient(
+            http2=True,
+            timeout=60.0,
+            limits=httpx.Limits(max_keepalive_connections=20, max_connections=100),
+        )
+        # One lock per audience so concurrent tool calls share a single token refresh.
+        self.token_locks: dict[str, asyncio.Lock] = {}
+
+_LOOP_RESOURCES: dict[asyncio.AbstractEventLoop, _LoopResources] = {}
+
+async def _close_with_loop(loop: asyncio.AbstractEventLoop, resources: _LoopResources):
+    """
+    Suspends until the event loop shuts down its async generators (asyncio.run
+    does this before closing the loop), then closes that loop's HTTP client.
+    """
+    try:
+        yield
+    finally:
+        if _LOOP_RESOURCES.get(loop) is resources:
+            del _LOOP_RESOURCES[loop]
+        await resources.http.aclose()
+
+def _loop_resources() -> _LoopResources:
+    """Returns the resources for the running event loop, creating them on first use."""
+    loop = asyncio.get_running_loop()
+    resources = _LOOP_RESOURCES.get(loop)
+    if resources is None:
+        # Drop anything left behind by loops that were closed without shutting
+        # down their async generators.
+        for stale in [l for l in _LOOP_RESOURCES if l.is_closed()]:
+            del _LOOP_RESOURCES[stale]
+        resources = _LOOP_RESOURCES[loop] = _LoopResources()
+        # Step the closer to its yield. Starting it registers it with the running
+        # loop, which closes it, and so the client, in shutdown_asyncgens().
+        resources.closer = _close_with_loop(loop, resources)
+        try:
+            resources.closer.asend(None).send(None)
+        except StopIteration:
+            pass
+    return resources
+
+def _http_client() -> httpx.AsyncClient:
+    """Returns the shared HTTP client for the running event loop."""
+    return _loop_resources().http
+
+async def aclose_http_client() -> None:
+    """Closes the running event loop's HTTP client. Call this once on agent shutdown."""
+    resources = _LOOP_RESOURCES.pop(asyncio.get_running_loop(), None)
+    if resources is not None:
+        await resources.http.aclose()
+
+async def _ping_validate_service() -> None:
+    """Sends one authenticated HEAD to the validation service's health path."""
+    url = f"{_VALIDATE_URL.rstrip('/')}/{_KEEP_WARM_PATH.lstrip('/')}"
+    try:
+        # Unauthenticated requests are rejected before reaching the container,
+        # so the ping has to carry an ID token to keep an instance alive.
+        identity_token = await _get_id_token(_VALIDATE_URL)
+        response = await _http_client().head(url, headers={"Authorization": f"Bearer {identity_token}"})
+    except Exception as e:
+        logger.warning("Keep-warm ping to %s failed: %s", url, e)
+        return
+    if not response.is_success:
+        logger.warning("Keep-warm ping to %s returned %s", url, response.status_code)
+
+async def _keep_warm() -> None:
+    """
+    Periodically pings the validation Cloud Run service so an instance stays
+    warm and tool calls don't pay for a cold start.
+
+    Pings go to KEEP_WARM_PATH, a cheap health route on that service, never to
+    the validation handler itself. Without it configured the pinger does
+    nothing. The deployment service is never pinged: any request that reaches
+    its handler starts the SCCM runbook.
+    """
+    if not _KEEP_WARM_PATH:
+        logger.info("KEEP_WARM_PATH is not set; not pinging the validation service.")
+        return
+    while True:
+        await _ping_validate_service()
+        await asyncio.sleep(_KEEP_WARM_INTERVAL)
+
+def start_keep_warm() -> asyncio.Task:
+    """Starts the keep-warm loop on the running event loop and returns its task."""
+    return asyncio.create_task(_keep_warm())
+
+async def _get_id_token(audience: str) -> str:
+    """
+    Returns an ID token for the given Cloud Run URL, reusing a cached token
+    until it is within a minute of expiring.
+    """
+    token, expiry = _ID_TOKEN_CACHE.get(audience, (None, 0.0))
+    if token and time.time() < expiry - _ID_TOKEN_REFRESH_MARGIN:
+        return token
+
+    lock = _loop_resources().token_locks.setdefault(audience, asyncio.Lock())
+    async with lock:
+        token, expiry = _ID_TOKEN_CACHE.get(audience, (None, 0.0))
+        if token and time.time() < expiry - _ID_TOKEN_REFRESH_MARGIN:
+            return token
+
+        # fetch_id_token does blocking HTTP IO, so keep it off the event loop.
+        token = await asyncio.to_thread(id_token.fetch_id_token, _AUTH_REQ, audience)
+        # The token was just issued by Google, so only its expiry is needed here.
+        claims = jwt.decode(token, verify=False)
+        _ID_TOKEN_CACHE[audience] = (token, float(claims["exp"]))
+        return token
+
+def _start_background(coro) -> asyncio.Task:
+    """
+    Runs a coroutine as a fire-and-forget task, holding a reference until it
+    finishes so it isn't garbage collected mid-flight.
+    """
+    task = asyncio.create_task(coro)
+    _BACKGROUND_TASKS.add(task)
+    task.add_done_callback(_BACKGROUND_TASKS.discard)
+    return task
+
+async def _prefetch_id_token(audience: str) -> None:
+    """
+    Warms the ID token cache for a later tool call. Failures are ignored here
+    and surface from the tool that actually needs the token.
+    """
+    try:
+        await _get_id_token(audience)
+    except Exception as e:
+        logger.debug("Could not prefetch ID token for %s: %s", audience, e)
+
 async def validate_workstation(tool_context: ToolContext) -> dict:
     """
     Triggers a secure Cloud Run service to validate the computername in SCCM.
-    """    
-    try:
-        # 1. Get the Cloud Run URL from environment variables for security.
-        function_url = os.getenv("VALIDATE_COMPUTER_URL")
-        if not function_url:
-            raise ValueError("VALIDATE_COMPUTER_URL environment variable is not set.")
-
-        # 2. Get the parameters from the agent's conversation state.        
-        computername = tool_context.state.get("computername")
-        
-        if not computername:
-            return {
-                "status": "error",
-                "result": "Deployment failed: Computername is missing from the conversation.",
-            }
+    """
+    # 1. Get the parameters from the agent's conversation state.        
+    computername = tool_context.state.get("computername")
+    
+    if not computername:
+        return {
+            "status": "error",
+            "result": "Deployment failed: Computername is missing from the conversation.",
+        }
 
-        # 3. Fetch an ID token with the Cloud Run URL as the audience
-        auth_req = google_requests.Request()
-        identity_token = id_token.fetch_id_token(auth_req, function_url)
+    # 2. Warm the token for the confirmation step's endpoint in the background so
+    # the later deployment call finds it cached. Validation doesn't wait on it.
+    _start_background(_prefetch_id_token(_PIPELINE_URL or _DEPLOY_URL))
 
-        # 4. Prepare the request headers for secure, authenticated invocation.
+    # 3. Prepare the JSON payload that your Cloud Run function expects.
+    payload = {            
+        "ComputerName": computername            
+    }
+
+    # 4. Make the secure, authenticated call.
+    return await _call_cloud_run(_VALIDATE_URL, payload, "validate", computername, retry=True)
+
+async def _call_cloud_run(
+    function_url: str,
+    payload: dict,
+    action: str,
+    subject: str,
+    *,
+    retry: bool = False,
+    idempotency_key: str | None = None,
+) -> dict:
+    """
+    Makes an authenticated POST to a Cloud Run service and converts the
+    response into a tool result. With retry=True, 429 and 5xx responses are
+    retried with jittered exponential backoff, so only pass it for idempotent calls.
+    """
+    try:
+        # 1. Fetch an ID token with the Cloud Run URL as the audience
+        identity_token = await _get_id_token(function_url)
+
+        # 2. Prepare the request headers for secure, authenticated invocation.
         headers = {
             "Authorization": f"Bearer {identity_token}",
             "Content-Type": "application/json"
         }
-
-        # 5. Prepare the JSON payload that your Cloud Run function expects.
-        payload = {            
-            "ComputerName": computername            
-        }
-
-        # 6. Make the secure, asynchronous HTTP call.
-        async with httpx.AsyncClient(timeout=60.0) as client:
-            print(f"DEBUG: Calling Cloud Run service to validate {computername}...")
-            response = await client.post(function_url, headers=headers, json=payload)
-            
-            # Raise an exception for HTTP errors (e.g., 403 Forbidden, 500 Internal Server Error)
-            response.raise_for_status()
-
-            final_status = response.text
-            print(f"DEBUG: Cloud Run service responded with: {final_status}")
+        if idempotency_key:
+            # Lets the service recognise a repeated request and skip duplicate work.
+            headers["Idempotency-Key"] = idempotency_key
+
+        # 3. Make the secure, asynchronous HTTP call. The body is pre-encoded
+        # with orjson, so httpx skips its own stdlib json serialization.
+        logger.debug("Calling Cloud Run service to %s %s...", action, subject)
+        body = orjson.dumps(payload)
+        attempts = _RETRY_ATTEMPTS if retry else 1
+        for attempt in range(attempts):
+            response = await _http_client().post(function_url, headers=headers, content=body)
+            # Cold starts commonly surface as 429/503 bursts that clear within a second or so.
+            if response.status_code < 500 and response.status_code != 429:
+                break
+            if attempt < attempts - 1:
+                delay = (2 ** attempt) * _RETRY_BASE_DELAY + random.random() * 0.1
+                logger.debug("Cloud Run service returned %s, retrying in %.2fs", response.status_code, delay)
+                await asyncio.sleep(delay)
+
+        final_status = response.text
+        logger.debug(
+            "Cloud Run service responded over %s with %s: %s",
+            response.http_version,
+            response.status_code,
+            final_status,
+        )
+        if response.is_success:
             return {"status": "success", "result": final_status}
+        # Surface HTTP errors (e.g., 403 Forbidden, 500 Internal Server Error) with their status code
+        return {"status": "error", "result": final_status, "http_status": response.status_code}
 
     except httpx.TimeoutException:
-        print("ERROR: Timeout calling the deployment service. The process is likely still running.")
+        logger.error("Timeout calling the deployment service. The process is likely still running.")
         return {
             "status": "success",
             "result": "The deployment has been started, but the connection timed out while waiting for a final status. Please check the system for progress.",
         }
-    except Exception as e:
-        print(f"ERROR: Failed to call deployment service: {e}")
+    except (httpx.RequestError, google_auth_exceptions.GoogleAuthError) as e:
+        logger.error("Failed to call deployment service: %s", e)
         return {
             "status": "error",
             "result": "A technical error occurred while trying to start the deployment.",
         }
 
+def update_session_state(
+    tool_context: ToolContext,
+    computer_name: str | None = None,
+    software_name: str | None = None,
+    username: str | None = None,
+):
+    """
+    Saves any of the computer name, software name and user name to the
+    session state. Only the values that are provided are written, so several
+    can be saved in one call.
+    """
+    saved = []
+    if computer_name is not None:
+        tool_context.state['computername'] = computer_name
+        saved.append(_MSG_COMPUTER % computer_name)
+    if software_name is not None:
+        tool_context.state['software_name'] = software_name
+        tool_context.state['software_name_cf'] = software_name.casefold()
+        saved.append(_MSG_SOFTWARE % software_name)
+    if username is not None:
+        tool_context.state['username'] = username
+        saved.append(_MSG_USER % username)
+
+    if not saved:
+        return {"status": "error", "result": "No values were provided to save."}
+    return {"status": "success", "result": " ".join(saved)}
+
+# Deprecated single-field tools, kept for one release for callers that still
+# register them. The agent itself uses update_session_state.
 def update_computer_state(computer_name: str, tool_context: ToolContext):
     """Saves the computer name to the session state."""    
-    tool_context.state['computername'] =  computer_name
-    return {"status": "success", "result": f"Computer name '{computer_name}' saved."}
+    return update_session_state(tool_context, computer_name=computer_name)
 
 def update_software_state(software_name: str, tool_context: ToolContext):
     """Saves the software name to the session state."""
-    tool_context.state['software_name'] =  software_name
-    return {"status": "success", "result": f"Software name '{software_name}' saved."}
+    return update_session_state(tool_context, software_name=software_name)
 
 def update_user_state(username: str, tool_context: ToolContext):
     """Saves the user name to the session state."""    
-    tool_context.state['username'] = username
-    return {"status": "success", "result": f"Username '{username}' saved."}
+    return update_session_state(tool_context, username=username)
 
 async def deploy_software(tool_context: ToolContext) -> dict:
     """
     Triggers a secure Cloud Run service to initiate the SCCM software deployment runbook.
     """
-    try:
-        # 1. Get the Cloud Run URL from environment variables for security.
-        function_url = os.getenv("DEPLOY_SOFTWARE_URL")
-        if not function_url:
-            raise ValueError("DEPLOY_SOFTWARE_URL environment variable is not set.")
-
-        # 2. Get the parameters from the agent's conversation state.
-        software_name = tool_context.state.get("software_name")
-        computername = tool_context.state.get("computername")
-        username = tool_context.state.get("username")
-
-        if not all([software_name, computername, username]):
-            return {
-                "status": "error",
-                "result": f"Deployment failed: One or more parameters were missing from the conversation. Software:{software_name} Computername:{computername} Username:{username}",
-            }
-
-        # 3. Fetch an ID token with the Cloud Run URL as the audience
-        auth_req = google_requests.Request()
-        identity_token = id_token.fetch_id_token(auth_req, function_url)
+    # 1. Get the parameters from the agent's conversation state.
+    payload = _deployment_payload(tool_context)
+    if isinstance(payload, str):
+        return {"status": "error", "result": payload}
+
+    # 2. Make the secure, authenticated call.
+    return await _call_cloud_run(
+        _DEPLOY_URL,
+        payload,
+        "deploy",
+        payload["SoftwareSelection"],
+        idempotency_key=_idempotency_key(payload),
+    )
+
+async def run_deployment_pipeline(tool_context: ToolContext) -> dict:
+    """
+    Validates the workstation and starts the SCCM software deployment in a
+    single call to the pipeline Cloud Run service. Only registered with the
+    agent when PIPELINE_URL is set.
+    """
+    # 1. Get the parameters from the agent's conversation state.
+    payload = _deployment_payload(tool_context)
+    if isinstance(payload, str):
+        return {"status": "error", "result": payload}
+
+    # 2. Make the secure, authenticated call.
+    return await _call_cloud_run(
+        _PIPELINE_URL,
+        payload,
+        "validate and deploy",
+        payload["SoftwareSelection"],
+        idempotency_key=_idempotency_key(payload),
+    )
+
+def _deployment_payload(tool_context: ToolContext) -> dict | str:
+    """
+    Builds the JSON payload the deployment services expect from the
+    conversation state, or returns an error message if anything is missing.
+    """
+    software_name = tool_context.state.get("software_name")
+    computername = tool_context.state.get("computername")
+    username = tool_context.state.get("username")
 
-        # 4. Prepare the request headers for secure, authenticated invocation.
-        headers = {
-            "Authorization": f"Bearer {identity_token}",
-            "Content-Type": "application/json"
-        }
+    if not all([software_name, computername, username]):
+        return f"Deployment failed: One or more parameters were missing from the conversation. Software:{software_name} Computername:{computername} Username:{username}"
 
-        # 5. Prepare the JSON payload that your Cloud Run function expects.
-        payload = {
-            "SoftwareSelection": software_name,
-            "ComputerName": computername,
-            "UID": username
-        }
-
-        # 6. Make the secure, asynchronous HTTP call.
-        async with httpx.AsyncClient(timeout=60.0) as client:
-            print(f"DEBUG: Calling Cloud Run service to deploy {software_name}...")
-            response = await client.post(function_url, headers=headers, json=payload)
-            
-            # Raise an exception for HTTP errors (e.g., 403 Forbidden, 500 Internal Server Error)
-            response.raise_for_status()
+    return {
+        "SoftwareSelection": software_name,
+        "ComputerName": computername,
+        "UID": username
+    }
 
-            final_status = response.text
-            print(f"DEBUG: Cloud Run service responded with: {final_status}")
-            return {"status": "success", "result": final_status}
+def _idempotency_key(payload: dict) -> str:
+    """
+    Identifies a deployment so the service can dedupe repeated requests. The
+    key is hashed because header values must be ASCII and names may not be.
+    """
+    key = f"{payload['UID']}:{payload['ComputerName']}:{payload['SoftwareSelection']}"
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()
 
-    except httpx.TimeoutException:
-        print("ERROR: Timeout calling the deployment service. The process is likely still running.")
-        return {
-            "status": "success",
-            "result": "The deployment has been started, but the connection timed out while waiting for a final status. Please check the system for progress.",
-        }
-    except Exception as e:
-        print(f"ERROR: Failed to call deployment service: {e}")
-        return {
-            "status": "error",
-            "result": "A technical error occurred while trying to start the deployment.",
-        }
 def verify_software_availability(tool_context: ToolContext) -> dict:
     """
     Verifies if the software requested by the user is in the approved list.
@@ -154,96 +414,95 @@ def verify_software_availability(tool_context: ToolContext) -> dict:
             "result": "Software name is missing from the conversation state for verification."
         }
     
-    # Normalize for case-insensitive comparison
-    normalized_software_name = software_name.lower()
-    # This line now refers to the imported list
-    normalized_approved_list = [s.lower() for s in APPROVED_SOFTWARE_LIST] 
+    # Case-insensitive comparison; update_software_state stores the normalized form
+    normalized_software_name = tool_context.state.get("software_name_cf") or software_name.casefold()
 
-    if normalized_software_name in normalized_approved_list:
+    if normalized_software_name in _APPROVED_CF:
         return {
             "status": "success",
             "result": f"Software '{software_name}' is available for deployment."
         }
     else:
-        # Suggest available software if not found
-        available_str = ", ".join(APPROVED_SOFTWARE_LIST) # This line also refers to the imported list
+        # Suggest the closest approved names if not found
+        matches = process.extract(
+            software_name,
+            _APPROVED_TUPLE,
+            scorer=fuzz.WRatio,
+            processor=utils.default_process,
+            limit=_SUGGESTION_LIMIT,
+            score_cutoff=_SUGGESTION_CUTOFF,
+        )
+        if not matches:
+            # Nothing is close, so offer the full list instead
+            return {
+                "status": "fail", 
+                "result": f"Software '{software_name}' is not an approved software. Please choose from: {_APPROVED_JOINED}."
+            }
+        suggestions = ", ".join(name for name, _, _ in matches)
         return {
             "status": "fail", 
-            "result": f"Software '{software_name}' is not an approved software. Please choose from: {available_str}."
+            "result": f"Software '{software_name}' is not an approved software. Did you mean: {suggestions}?"
         }
 
 def list_available_software(tool_context: ToolContext) -> dict:
     """
     Provides a list of all software available for deployment.
     """
-    available_str = ", ".join(APPROVED_SOFTWARE_LIST) # This line also refers to the imported list
     return {
         "status": "success",
-        "result": available_str
+        "result": _APPROVED_JOINED
     }
 
-root_agent = LlmAgent(
-    name="deployment_orchestrator_agent",
-    model="gemini-2.0-flash",
-    description="A conversational agent that collects information, validates it, and deploys software.",
-    instruction=(
-    """
-    You are a friendly and helpful IT support agent named 'Gem'. Your primary goal is to assist users with deploying approved software to their workstations. You should be conversational, helpful, and guide the user through the process in a clear and easy-to-understand way.
-
-    **Core Workflow:**
-
-    Your main task is to collect three pieces of information from the user:
-    1. The software they want to install.
-    2. The computer name (or hostname) of the target machine.
-    3. The user's username.
-
-    Once you have this information, you will confirm it with the user and then proceed with the deployment.
-
-    **Guidelines for a Smooth Conversation:**
-
-    *   **Be Conversational**: Don't be a robot! Use natural language and be friendly.
-    *   **One Thing at a Time**: Ask for one piece of information at a time. This makes the process less overwhelming for the user.
-    *   **State Management is Your Responsibility**: Use the `update_*_state` tools to save the information the user provides to the session state. You don't need to tell the user that you are doing this.
-    *   **Validate as You Go**: After the user provides a piece of information, use the appropriate validation tool (`verify_software_availability` or `validate_workstation`) to check if it's valid.
-    *   **Handle Errors Gracefully**: If a validation fails, let the user know in a clear and friendly way what the problem is and how to fix it.
-    *   **Be Flexible**: The user might not always follow the workflow perfectly. Be prepared to answer questions, go back a step, or correct information if the user asks.
-
-    **Example Conversation Flow:**
-
-    1.  **Greeting and Initial Question**: Start by greeting the user and asking what software they would like to install.
-        *   *Example*: "Hello! I'm Gem, your IT support assistant. I can help you deploy software to your workstation. What software would you like to install today?"
-    2.  **Software Validation**:
-        *   Once the user provides a software name, use the `update_software_state` tool to save it.
-        *   Then, use the `verify_software_availability` tool to check if it's an approved software.
-        *   If the software is not available, let the user know and provide them with a list of available software using the `list_available_software` tool.
-    3.  **Computer Name**:
-        *   Once the software is validated, ask for the computer name.
-        *   *Example*: "Great! '{{software_name}}' is an approved software. Now, what is the computer name or hostname of the machine you want to deploy to?"
-        *   Use `update_computer_state` and `validate_workstation` to save and validate the computer name.
-    4.  **Username**:
-        *   Once the computer name is validated, ask for the username.
-        *   *Example*: "Perfect, the computer name '{{computername}}' is valid. Finally, what is your username?"
-        *   Use `update_user_state` to save the username.
-    5.  **Confirmation and Deployment**:
-        *   Once you have all three pieces of information, confirm them with the user.
-        *   *Example*: "Alright, let's double-check everything. You want to install '{{software_name}}' on the computer '{{computername}}' for the user '{{username}}'. Is that correct?"
-        *   If the user confirms, use the `deploy_software` tool to start the deployment. Let the user know that the deployment has started and that they will be notified when it's complete.
-        *   If the user says something is incorrect, ask them what needs to be changed and go back to the appropriate step.
-
-    **Listing Available Software:**
-
-    *   If the user asks what software is available, use the `list_available_software` tool and present the list in a clear and friendly way.
-    *   *Example*: "Here is a list of the software I can install for you: {{tool_context.last_tool_result.get('result')}}"
-    """
-    ),
-    # The agent now has direct access to ALL the tools it needs.
-    tools=[
-        validate_workstation,
-        update_computer_state,
-        update_software_state,
-        update_user_state,
-        deploy_software,
-        verify_software_availability,
-        list_available_software
-    ]
-)
\ No newline at end of file
+# Fills the {placeholders} in prompt.md. Without a pipeline endpoint the
+# workstation is validated as soon as it is given and deploy_software runs after
+# confirmation. With one, run_deployment_pipeline validates and deploys in a
+# single call, so the workstation is not validated separately beforehand.
+_DIRECT_PROMPT = {
+    "validation_tools": "`verify_software_availability` or `validate_workstation`",
+    "save_computer": "Use `update_session_state` and `validate_workstation` to save and validate the computer name.",
+    "computer_ready": "validated",
+    "computer_ack": "Perfect, the computer name '{{computername}}' is valid.",
+    "deploy_step": "use the `deploy_software` tool to start the deployment.",
+}
+_PIPELINE_PROMPT = {
+    "validation_tools": "`verify_software_availability`",
+    "save_computer": "Use `update_session_state` to save the computer name. It is validated together with the deployment in the final step, so there is nothing to validate yet.",
+    "computer_ready": "saved",
+    "computer_ack": "Thanks, I've noted the computer name '{{computername}}'.",
+    "deploy_step": "use the `run_deployment_pipeline` tool, which validates the computer name and starts the deployment in one step. If it reports that the computer name is invalid, ask the user for the correct one, save it, and try again.",
+}
+
+@functools.lru_cache(maxsize=1)
+def get_root_agent() -> LlmAgent:
+    """Builds the root agent on first use and returns the same instance afterwards."""
+    if _PIPELINE_URL:
+        fragments = _PIPELINE_PROMPT
+        tools = [update_session_state, run_deployment_pipeline]
+    else:
+        fragments = _DIRECT_PROMPT
+        tools = [validate_workstation, update_session_state, deploy_software]
+
+    # The agent instruction lives alongside this module.
+    instruction = (importlib.resources.files(__package__) / "prompt.md").read_text(encoding="utf-8")
+    for placeholder, text in fragments.items():
+        instruction = instruction.replace(f"{{{placeholder}}}", text)
+
+    return LlmAgent(
+        name="deployment_orchestrator_agent",
+        model="gemini-2.0-flash",
+        description="A conversational agent that collects information, validates it, and deploys software.",
+        instruction=instruction,
+        # The agent now has direct access to ALL the tools it needs.
+        tools=[
+            *tools,
+            verify_software_availability,
+            list_available_software
+        ]
+    )
+
+def __getattr__(name: str):
+    # Keeps `from software_agent.agent import root_agent` and the ADK CLI loader,
+    # which look up `root_agent`, working without building the agent at import.
+    if name == "root_agent":
+        return get_root_agent()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,6 @@
+import os
+
+# software_agent.agent reads its Cloud Run URLs at import, so they must be set
+# before any test module imports it.
+os.environ.setdefault("VALIDATE_COMPUTER_URL", "https://validate.example.run.app")
+os.environ.setdefault("DEPLOY_SOFTWARE_URL", "https://deploy.example.run.app")
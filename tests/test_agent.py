@@ -0,0 +1,435 @@
+import asyncio
+import importlib.resources
+import re
+import time
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, Mock
+
+import httpx
+import pytest
+
+from software_agent import agent
+
+
+@pytest.fixture(autouse=True)
+def clear_token_cache():
+    agent._ID_TOKEN_CACHE.clear()
+    yield
+    agent._ID_TOKEN_CACHE.clear()
+
+
+@pytest.fixture
+def token_expiry():
+    """Mutable expiry returned as the `exp` claim of every fetched token."""
+    return {"exp": time.time() + 3600}
+
+
+@pytest.fixture
+def fetch_id_token(monkeypatch, token_expiry):
+    """Replaces the metadata-server token fetch with a counting mock."""
+    fetch = Mock(side_effect=lambda request, audience: f"token-{fetch.call_count}")
+    monkeypatch.setattr(agent.id_token, "fetch_id_token", fetch)
+    monkeypatch.setattr(agent.jwt, "decode", lambda token, verify: {"exp": token_expiry["exp"]})
+    return fetch
+
+
+@pytest.fixture
+def http(monkeypatch):
+    """Replaces the shared HTTP client with one whose post and head are AsyncMocks."""
+    client = SimpleNamespace(
+        post=AsyncMock(return_value=make_response(200)),
+        head=AsyncMock(return_value=make_response(200)),
+    )
+    monkeypatch.setattr(agent, "_http_client", lambda: client)
+    return client
+
+
+def make_response(status_code, text="ok"):
+    return httpx.Response(status_code, text=text, request=httpx.Request("POST", "https://example.run.app"))
+
+
+def make_tool_context(**state):
+    return SimpleNamespace(state=dict(state))
+
+
+def posted_urls(http):
+    return [call.args[0] for call in http.post.await_args_list]
+
+
+@pytest.mark.asyncio
+async def test_get_id_token_reuses_cached_token(fetch_id_token):
+    first = await agent._get_id_token("https://validate.example.run.app")
+    second = await agent._get_id_token("https://validate.example.run.app")
+
+    assert first == second == "token-1"
+    assert fetch_id_token.call_count == 1
+
+
+@pytest.mark.asyncio
+async def test_get_id_token_refreshes_near_expiry(fetch_id_token, token_expiry):
+    token_expiry["exp"] = time.time() + agent._ID_TOKEN_REFRESH_MARGIN / 2
+
+    first = await agent._get_id_token("https://validate.example.run.app")
+    second = await agent._get_id_token("https://validate.example.run.app")
+
+    assert (first, second) == ("token-1", "token-2")
+    assert fetch_id_token.call_count == 2
+
+
+@pytest.mark.asyncio
+async def test_get_id_token_caches_per_audience(fetch_id_token):
+    await agent._get_id_token("https://validate.example.run.app")
+    await agent._get_id_token("https://deploy.example.run.app")
+
+    assert fetch_id_token.call_count == 2
+
+
+@pytest.mark.asyncio
+async def test_get_id_token_concurrent_callers_share_one_refresh(fetch_id_token):
+    tokens = await asyncio.gather(
+        *(agent._get_id_token("https://validate.example.run.app") for _ in range(5))
+    )
+
+    assert set(tokens) == {"token-1"}
+    assert fetch_id_token.call_count == 1
+
+
+@pytest.mark.asyncio
+@pytest.mark.usefixtures("fetch_id_token")
+async def test_pipeline_with_endpoint_makes_one_call(monkeypatch, http):
+    monkeypatch.setattr(agent, "_PIPELINE_URL", "https://pipeline.example.run.app")
+    tool_context = make_tool_context(software_name="Zoom", computername="PC-01", username="jdoe")
+
+    result = await agent.run_deployment_pipeline(tool_context)
+
+    assert result["status"] == "success"
+    assert posted_urls(http) == ["https://pipeline.example.run.app"]
+
+
+@pytest.mark.asyncio
+async def test_pipeline_missing_state_makes_no_call(monkeypatch, http):
+    monkeypatch.setattr(agent, "_PIPELINE_URL", "https://pipeline.example.run.app")
+    tool_context = make_tool_context(software_name="Zoom", computername=None, username="jdoe")
+
+    result = await agent.run_deployment_pipeline(tool_context)
+
+    assert result["status"] == "error"
+    http.post.assert_not_awaited()
+
+
+@pytest.mark.asyncio
+async def test_validate_without_computername_skips_prefetch(http, fetch_id_token):
+    pending = set(agent._BACKGROUND_TASKS)
+
+    result = await agent.validate_workstation(make_tool_context(computername=None))
+
+    assert result["status"] == "error"
+    http.post.assert_not_awaited()
+    assert agent._BACKGROUND_TASKS <= pending
+    fetch_id_token.assert_not_called()
+
+
+@pytest.fixture
+def no_backoff(monkeypatch):
+    """Removes the retry delay so retry tests run instantly."""
+    monkeypatch.setattr(agent, "_RETRY_BASE_DELAY", 0)
+    monkeypatch.setattr(agent, "random", SimpleNamespace(random=lambda: 0.0))
+
+
+@pytest.mark.asyncio
+@pytest.mark.usefixtures("fetch_id_token", "no_backoff")
+async def test_validate_retries_transient_errors(http):
+    http.post.side_effect = [make_response(503), make_response(429), make_response(200, "PC-01 found")]
+
+    result = await agent.validate_workstation(make_tool_context(computername="PC-01"))
+
+    assert result == {"status": "success", "result": "PC-01 found"}
+    assert http.post.await_count == 3
+
+
+@pytest.mark.asyncio
+@pytest.mark.usefixtures("fetch_id_token", "no_backoff")
+async def test_validate_gives_up_after_retry_attempts(http):
+    http.post.return_value = make_response(503, "unavailable")
+
+    result = await agent.validate_workstation(make_tool_context(computername="PC-01"))
+
+    assert result == {"status": "error", "result": "unavailable", "http_status": 503}
+    assert http.post.await_count == agent._RETRY_ATTEMPTS
+
+
+@pytest.mark.asyncio
+@pytest.mark.usefixtures("fetch_id_token", "no_backoff")
+async def test_validate_does_not_retry_client_errors(http):
+    http.post.return_value = make_response(404, "not found")
+
+    result = await agent.validate_workstation(make_tool_context(computername="PC-01"))
+
+    assert result["http_status"] == 404
+    assert http.post.await_count == 1
+
+
+@pytest.mark.asyncio
+@pytest.mark.usefixtures("fetch_id_token", "no_backoff")
+async def test_deploy_does_not_retry(http):
+    http.post.return_value = make_response(503, "unavailable")
+    tool_context = make_tool_context(software_name="Zoom", computername="PC-01", username="jdoe")
+
+    result = await agent.deploy_software(tool_context)
+
+    assert result["http_status"] == 503
+    assert http.post.await_count == 1
+
+
+@pytest.mark.asyncio
+@pytest.mark.usefixtures("fetch_id_token")
+async def test_deploy_idempotency_key_is_ascii_for_non_ascii_names(http):
+    tool_context = make_tool_context(software_name="Zoom", computername="PC-01", username="José")
+
+    result = await agent.deploy_software(tool_context)
+
+    assert result["status"] == "success"
+    headers = http.post.await_args.kwargs["headers"]
+    assert headers["Idempotency-Key"].isascii()
+    # httpx must be able to encode the headers for the request to be sent at all.
+    httpx.Request("POST", agent._DEPLOY_URL, headers=headers)
+
+
+def test_verify_software_suggests_close_matches():
+    result = agent.verify_software_availability(make_tool_context(software_name="Google Chrom"))
+
+    assert result["status"] == "fail"
+    assert "Did you mean: Google Chrome" in result["result"]
+
+
+def test_verify_software_lists_everything_when_nothing_is_close():
+    result = agent.verify_software_availability(make_tool_context(software_name="!!!"))
+
+    assert result["status"] == "fail"
+    assert agent._APPROVED_JOINED in result["result"]
+    assert "Did you mean" not in result["result"]
+
+
+def test_update_session_state_writes_only_provided_fields():
+    tool_context = make_tool_context(computername="PC-01", username="jdoe")
+
+    result = agent.update_session_state(tool_context, software_name="Straße")
+
+    assert result == {"status": "success", "result": "Software name 'Straße' saved."}
+    assert tool_context.state == {
+        "computername": "PC-01",
+        "username": "jdoe",
+        "software_name": "Straße",
+        "software_name_cf": "strasse",
+    }
+
+
+def test_update_session_state_saves_several_fields_at_once():
+    tool_context = make_tool_context()
+
+    result = agent.update_session_state(tool_context, computer_name="PC-01", username="jdoe")
+
+    assert result["status"] == "success"
+    assert tool_context.state == {"computername": "PC-01", "username": "jdoe"}
+
+
+def test_update_session_state_without_values_is_an_error():
+    tool_context = make_tool_context(computername="PC-01")
+
+    result = agent.update_session_state(tool_context)
+
+    assert result["status"] == "error"
+    assert tool_context.state == {"computername": "PC-01"}
+
+
+def test_deprecated_update_tools_delegate_to_update_session_state():
+    tool_context = make_tool_context()
+
+    agent.update_computer_state("PC-01", tool_context)
+    agent.update_software_state("Zoom", tool_context)
+    agent.update_user_state("jdoe", tool_context)
+
+    assert tool_context.state == {
+        "computername": "PC-01",
+        "software_name": "Zoom",
+        "software_name_cf": "zoom",
+        "username": "jdoe",
+    }
+
+
+def test_each_event_loop_gets_its_own_client_closed_at_shutdown():
+    async def resources_for_this_loop():
+        return asyncio.get_running_loop(), agent._loop_resources()
+
+    first_loop, first = asyncio.run(resources_for_this_loop())
+    second_loop, second = asyncio.run(resources_for_this_loop())
+
+    assert first is not second
+    assert first.http is not second.http
+    assert first.http.is_closed and second.http.is_closed
+    assert first_loop not in agent._LOOP_RESOURCES
+    assert second_loop not in agent._LOOP_RESOURCES
+
+
+def test_loop_resources_prunes_entries_for_closed_loops():
+    stale_loop = asyncio.new_event_loop()
+    stale_loop.close()
+    agent._LOOP_RESOURCES[stale_loop] = object()
+
+    async def resources_for_this_loop():
+        return agent._loop_resources()
+
+    try:
+        asyncio.run(resources_for_this_loop())
+        assert stale_loop not in agent._LOOP_RESOURCES
+    finally:
+        agent._LOOP_RESOURCES.pop(stale_loop, None)
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    "pipeline_url, expected_audience",
+    [
+        (None, "https://deploy.example.run.app"),
+        ("https://pipeline.example.run.app", "https://pipeline.example.run.app"),
+    ],
+)
+async def test_validate_prefetches_token_for_confirmation_endpoint(
+    monkeypatch, http, fetch_id_token, pipeline_url, expected_audience
+):
+    monkeypatch.setattr(agent, "_PIPELINE_URL", pipeline_url)
+    pending = set(agent._BACKGROUND_TASKS)
+
+    await agent.validate_workstation(make_tool_context(computername="PC-01"))
+    await asyncio.gather(*(agent._BACKGROUND_TASKS - pending))
+
+    audiences = {call.args[1] for call in fetch_id_token.call_args_list}
+    assert audiences == {agent._VALIDATE_URL, expected_audience}
+
+
+@pytest.mark.asyncio
+@pytest.mark.usefixtures("fetch_id_token")
+async def test_keep_warm_ping_targets_health_path(monkeypatch, http, caplog):
+    monkeypatch.setattr(agent, "_KEEP_WARM_PATH", "/healthz")
+
+    with caplog.at_level("WARNING", logger=agent.logger.name):
+        await agent._ping_validate_service()
+
+    http.head.assert_awaited_once()
+    assert http.head.await_args.args[0] == "https://validate.example.run.app/healthz"
+    http.post.assert_not_awaited()
+    assert not caplog.records
+
+
+@pytest.mark.asyncio
+@pytest.mark.usefixtures("fetch_id_token")
+@pytest.mark.parametrize("status_code", [401, 403, 503])
+async def test_keep_warm_ping_warns_on_error_status(monkeypatch, http, caplog, status_code):
+    monkeypatch.setattr(agent, "_KEEP_WARM_PATH", "/healthz")
+    http.head.return_value = make_response(status_code)
+
+    with caplog.at_level("WARNING", logger=agent.logger.name):
+        await agent._ping_validate_service()
+
+    assert [record.levelname for record in caplog.records] == ["WARNING"]
+    assert str(status_code) in caplog.records[0].getMessage()
+
+
+@pytest.mark.asyncio
+async def test_keep_warm_does_nothing_without_health_path(monkeypatch, http):
+    monkeypatch.setattr(agent, "_KEEP_WARM_PATH", None)
+
+    await asyncio.wait_for(agent._keep_warm(), timeout=1)
+
+    http.head.assert_not_awaited()
+
+
+@pytest.mark.asyncio
+@pytest.mark.usefixtures("fetch_id_token")
+async def test_start_keep_warm_pings_until_cancelled(monkeypatch, http):
+    monkeypatch.setattr(agent, "_KEEP_WARM_PATH", "/healthz")
+    monkeypatch.setattr(agent, "_KEEP_WARM_INTERVAL", 3600)
+
+    task = agent.start_keep_warm()
+    for _ in range(100):
+        if http.head.await_count:
+            break
+        await asyncio.sleep(0.01)
+    task.cancel()
+
+    with pytest.raises(asyncio.CancelledError):
+        await task
+    assert http.head.await_count == 1
+
+
+def test_prompt_is_packaged_with_the_module():
+    prompt = importlib.resources.files("software_agent") / "prompt.md"
+
+    assert prompt.is_file()
+
+
+@pytest.fixture
+def fresh_root_agent():
+    """Clears the cached root agent so each test builds its own."""
+    agent.get_root_agent.cache_clear()
+    yield
+    agent.get_root_agent.cache_clear()
+
+
+def tool_names(root_agent):
+    return {getattr(tool, "__name__", getattr(tool, "name", None)) for tool in root_agent.tools}
+
+
+def unfilled_placeholders(instruction):
+    # Single-brace {name} would be treated by ADK as session state to inject;
+    # the prompt's own double-brace examples are left alone.
+    return re.findall(r"(?<!\{)\{\w+\}(?!\})", instruction)
+
+
+@pytest.mark.usefixtures("fresh_root_agent")
+def test_root_agent_without_pipeline_validates_then_deploys(monkeypatch):
+    monkeypatch.setattr(agent, "_PIPELINE_URL", None)
+
+    root_agent = agent.get_root_agent()
+
+    assert tool_names(root_agent) == {
+        "validate_workstation",
+        "update_session_state",
+        "deploy_software",
+        "verify_software_availability",
+        "list_available_software",
+    }
+    assert unfilled_placeholders(root_agent.instruction) == []
+    assert "`deploy_software`" in root_agent.instruction
+    assert "run_deployment_pipeline" not in root_agent.instruction
+
+
+@pytest.mark.usefixtures("fresh_root_agent")
+def test_root_agent_with_pipeline_skips_separate_validation(monkeypatch):
+    monkeypatch.setattr(agent, "_PIPELINE_URL", "https://pipeline.example.run.app")
+
+    root_agent = agent.get_root_agent()
+
+    assert tool_names(root_agent) == {
+        "update_session_state",
+        "run_deployment_pipeline",
+        "verify_software_availability",
+        "list_available_software",
+    }
+    assert unfilled_placeholders(root_agent.instruction) == []
+    assert "`run_deployment_pipeline`" in root_agent.instruction
+    assert "validate_workstation" not in root_agent.instruction
+    assert "deploy_software" not in root_agent.instruction
+
+
+@pytest.mark.usefixtures("fresh_root_agent")
+def test_root_agent_attribute_resolves_to_cached_agent():
+    root_agent = agent.root_agent
+
+    assert root_agent is agent.get_root_agent()
+    assert agent.root_agent is root_agent
+
+
+def test_unknown_module_attribute_still_raises():
+    with pytest.raises(AttributeError):
+        agent.not_an_attribute
@@ -1,3 +1,6 @@
+import asyncio
+import threading
+
 from google.genai import types
 
 # ANSI color codes for terminal output
@@ -27,6 +30,38 @@ class Colors:
     BG_WHITE = "\033[47m"
 
 
+async def async_input(prompt):
+    """
+    Reads a line from stdin without blocking the event loop.
+
+    The read happens on a daemon thread rather than the default executor, so a
+    Ctrl+C while waiting at the prompt exits immediately instead of waiting
+    for the blocked input() call to return.
+    """
+    loop = asyncio.get_running_loop()
+    future = loop.create_future()
+
+    def deliver(set_outcome, outcome):
+        if not future.done():
+            set_outcome(outcome)
+
+    def read():
+        try:
+            line = input(prompt)
+        except BaseException as e:
+            setter, outcome = future.set_exception, e
+        else:
+            setter, outcome = future.set_result, line
+        try:
+            loop.call_soon_threadsafe(deliver, setter, outcome)
+        except RuntimeError:
+            # The loop already closed; nobody is waiting for this line.
+            pass
+
+    threading.Thread(target=read, daemon=True).start()
+    return await future
+
+
 # FIX 1: The function must be 'async def' to use 'await' inside it.
 async def display_state(
     session_service, app_name, user_id, session_id, label="Current State"